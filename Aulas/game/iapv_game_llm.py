@@ -1,24 +1,123 @@
 # -*- coding: utf-8 -*-
 import os
+import io
+import re
+import wave
+import atexit
+import shutil
+import tempfile
 import json
 import time
 import random
+import asyncio
 import threading
+import queue
+import collections
+import functools
 import tkinter as tk
 from tkinter import scrolledtext, messagebox
-from PIL import Image, ImageTk
-from groq import Groq
+import numpy as np
+from PIL import Image, ImageDraw, ImageTk
+from groq import AsyncGroq, RateLimitError, APIConnectionError, APITimeoutError
+from tenacity import retry, stop_after_attempt, wait_exponential_jitter, retry_if_exception_type
 from dotenv import load_dotenv
 import pyttsx3
 import winsound
 
+# JSON rápido (orjson) se estiver instalado; senão o json normal
+try:
+    import orjson
+    _json_loads = orjson.loads
+    def _json_dumps(obj): return orjson.dumps(obj).decode("utf-8")
+except ImportError:
+    _json_loads = json.loads
+    def _json_dumps(obj): return json.dumps(obj, ensure_ascii=False)
+
 # --- 1. CONFIGURAÇÃO E INIT ---
 
 # Carregar API Key - https://console.groq.com/keys ## TODO: Colocar a tua chave num ficheiro .env
 load_dotenv()
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))
 MODEL = "llama-3.3-70b-versatile"
 
+# Preâmbulo fixo (igual em todos os pedidos); cada pedido só leva as diferenças
+SYSTEM_MSG = 'You are Elira. Reply as JSON: {"text": "...", "emotion": "idle/happy/anxious"}'
+HISTORY_TURNS = 3    # Conversas recentes enviadas como memória
+HISTORY_CHARS = 120  # Tamanho máximo de cada uma (orçamento fixo de tokens)
+
+# Cache de respostas: exata (LRU) + semântica para o chat livre
+REPLY_CACHE_SIZE = 256
+SEMANTIC_THRESHOLD = 0.93  # Similaridade de cosseno mínima para reaproveitar uma resposta
+_embedder = None           # Carregado só quando for preciso (None = ainda não tentou)
+_embedder_lock = threading.Lock()  # Dois pedidos seguidos não carregam (nem descarregam) o modelo duas vezes
+
+# Reações espontâneas: no máximo uma a cada N segundos (o plano gratuito dá 30 pedidos/min)
+SPONTANEOUS_INTERVAL = 2.0
+
+def _embed(text):
+    """Embedding normalizado da frase, ou None se o sentence-transformers não estiver disponível."""
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:  # Outra thread pode tê-lo carregado enquanto esperávamos
+                try:
+                    from sentence_transformers import SentenceTransformer
+                    _embedder = SentenceTransformer("all-MiniLM-L6-v2")
+                except Exception as e:
+                    print(f"Aviso: cache semântica desligada ({e}).")
+                    _embedder = False
+    if not _embedder: return None
+    return _embedder.encode(text, normalize_embeddings=True)
+
+# Erros transitórios (limite por minuto, rede) esperam um pouco e tentam outra vez
+@retry(stop=stop_after_attempt(3),
+       wait=wait_exponential_jitter(initial=0.5, max=4),
+       retry=retry_if_exception_type((RateLimitError, APIConnectionError, APITimeoutError)),
+       reraise=True)
+async def _call_groq(user_msg, max_tok, stream=True):
+    # Com streaming os tokens chegam à medida que são gerados; sem ele, usa o modo JSON
+    # estrito (a Groq não junta os dois) e a resposta é sempre um objeto válido
+    extra = {} if stream else {"response_format": {"type": "json_object"}}
+    return await client.chat.completions.create(
+        model=MODEL,
+        messages=[{"role": "system", "content": SYSTEM_MSG},
+                  {"role": "user", "content": user_msg}],
+        max_tokens=max_tok, 
+        temperature=0.8,
+        stream=stream,
+        **extra
+    )
+
+_TEXT_FIELD = re.compile(r'"text"\s*:\s*"')
+
+def _partial_text(buffer):
+    """Valor (já descodificado) do campo "text" de um JSON ainda a meio de chegar."""
+    match = _TEXT_FIELD.search(buffer)
+    if not match: return ""
+    out, i = [], match.end()
+    while i < len(buffer):
+        ch = buffer[i]
+        if ch == '"': break
+        if ch == "\\":
+            size = 6 if buffer[i+1:i+2] == "u" else 2
+            if size == 6 and buffer[i+2:i+4].lower() in ("d8", "d9", "da", "db"):
+                size = 12  # Metade alta de um par (emoji): só se descodifica junto com a outra
+            escape = buffer[i:i+size]
+            if len(escape) < size: break  # O resto do escape ainda não chegou
+            try: text = json.loads(f'"{escape}"')
+            except ValueError: text = None
+            if size == 12 and (text is None or len(text) != 1):
+                size, text = 6, "\ufffd"  # Metade solta: o Tk não aceita surrogates
+            elif text is None: break
+            elif "\ud800" <= text <= "\udfff":
+                text = "\ufffd"  # Metade baixa solta
+            out.append(text)
+            i += size
+            continue
+        out.append(ch)
+        i += 1
+    return "".join(out)
+
 # Inicializar TTS (Voz)
 tts_engine = None
 try:
@@ -39,46 +138,199 @@ try:
 except Exception as e:
     print(f"Aviso: TTS não iniciou ({e}).")
 
-def speak_text(text):
-    """Tenta falar. Se o motor estiver ocupado, ignora para não travar o jogo."""
-    if not tts_engine: return
-    
-    def speak_thread():
+_tts_q = queue.Queue(maxsize=8)
+
+def _tts_worker():
+    """Única thread de voz: o pyttsx3 só aguenta um runAndWait de cada vez."""
+    while True:
+        text = _tts_q.get()
         try:
-            # Em vez de tentar parar à força (o que encrava), apenas fala se possível
             tts_engine.say(text)
             tts_engine.runAndWait()
-        except RuntimeError:
-            # Se o motor já estiver a falar (loop running), ignoramos esta frase
-            # Isto impede o erro "run loop already started" que congela tudo
-            pass
         except Exception as e:
             print(f"Erro de voz: {e}")
 
-    threading.Thread(target=speak_thread, daemon=True).start()
+def speak_text(text):
+    """Põe a frase na fila de voz. Se a fila estiver cheia, descarta a mais antiga para não travar o jogo."""
+    if not tts_engine: return
+    try:
+        _tts_q.put_nowait(text)
+    except queue.Full:
+        try: _tts_q.get_nowait()
+        except queue.Empty: pass
+        try: _tts_q.put_nowait(text)
+        except queue.Full: pass
+
+if tts_engine:
+    threading.Thread(target=_tts_worker, daemon=True).start()
+
+# Sons sintéticos: cada sequência de (frequência Hz, duração ms) é gerada uma só vez como WAV
+SAMPLE_RATE = 22050
+SOUNDS = {
+    "revelio": [(1000, 100), (1500, 100), (2000, 200)],     # Agudo e rápido (Revelação)
+    "aurum": [(2500, 100), (4000, 300)],                    # Moeda (Ouro)
+    "lumen": [(freq, 40) for freq in range(400, 1000, 100)], # Grave para agudo (Luz a expandir)
+    "victory": [(600, 100), (800, 100), (1200, 300)],
+    "defeat": [(300, 200), (150, 400)],
+}
+
+def _synth_wav(notes):
+    """WAV mono de 16 bits com as notas seguidas (ondas sinusoidais)."""
+    parts = []
+    for freq, ms in notes:
+        t = np.arange(SAMPLE_RATE * ms // 1000) / SAMPLE_RATE
+        parts.append(np.sin(2 * np.pi * freq * t))
+    samples = (np.concatenate(parts) * 0.5 * 32767).astype("<i2")
+
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(samples.tobytes())
+    return buf.getvalue()
+
+# O winsound não toca WAVs da memória em modo assíncrono, por isso ficam num ficheiro temporário
+_SOUND_DIR = tempfile.mkdtemp(prefix="elira_sfx_")
+atexit.register(shutil.rmtree, _SOUND_DIR, True)
+SOUND_FILES = {}
+for _name, _notes in SOUNDS.items():
+    SOUND_FILES[_name] = os.path.join(_SOUND_DIR, f"{_name}.wav")
+    with open(SOUND_FILES[_name], "wb") as _f:
+        _f.write(_synth_wav(_notes))
+
+def play_sound(name):
+    """Uma só chamada assíncrona ao sistema (em vez de vários Beeps bloqueantes numa thread)."""
+    try:
+        winsound.PlaySound(SOUND_FILES[name], winsound.SND_FILENAME | winsound.SND_ASYNC | winsound.SND_NODEFAULT)
+    except Exception as e:
+        print(f"Erro de som: {e}")
 
 # --- 2. DADOS DO JOGO ---
 
 WIDTH, HEIGHT = 18, 12  # TODO: Ajustar tamanho do mapa
+LOG_MAX_LINES = 300     # O chat guarda só as últimas linhas
 CELL_SIZE = 50          # Reduzi um pouco para caber no ecrã
 ASSET_DIR = "assets_50"
-MEMORY_FILE = "elira_memory_rpg.json"
+MEMORY_FILE = "elira_memory_rpg.jsonl"  # Registo append-only: uma conversa por linha
+LEGACY_MEMORY_FILE = "elira_memory_rpg.json"  # Formato antigo (JSON inteiro), importado uma vez
+MEMORY_RECALL = HISTORY_TURNS           # Conversas antigas lidas ao arrancar
+
+# Mapa de distâncias até ao alvo (BFS) e direções a seguir, ambos em arrays planos r*WIDTH+c
+DIST_UNREACHABLE = np.iinfo(np.uint16).max
+DIR_NORTH, DIR_SOUTH, DIR_WEST, DIR_EAST = 1, 2, 4, 8
+DIR_NAMES = {DIR_NORTH: "North", DIR_SOUTH: "South", DIR_WEST: "West", DIR_EAST: "East"}
+
+# Tipos de célula: índice na lista de imagens pré-compostas (self.tiles)
+TILE_FOG, TILE_GOLD, TILE_FLOOR, TILE_EXIT, TILE_WALL, TILE_TRAP, TILE_TREASURE = range(7)
+
+# Camadas do mapa (paredes, armadilhas, tesouros...) guardadas como bitsets: bit r*WIDTH+c
+ALL_CELLS = (1 << (WIDTH * HEIGHT)) - 1
+
+def _idx(r, c):
+    return r * WIDTH + c
+
+def _mask_to_bits(mask):
+    """Máscara booleana (HEIGHT, WIDTH) do NumPy -> int com um bit por célula."""
+    return int.from_bytes(np.packbits(mask.ravel(), bitorder="little").tobytes(), "little")
+
+def _iter_bits(bits):
+    """Índices das células com o bit ligado."""
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+# Vizinhos N/S/W/E de cada célula (para o sentido de perigo)
+_ADJ_MASK = []
+for _r in range(HEIGHT):
+    for _c in range(WIDTH):
+        _bits = 0
+        for _nr, _nc in ((_r - 1, _c), (_r + 1, _c), (_r, _c - 1), (_r, _c + 1)):
+            if 0 <= _nr < HEIGHT and 0 <= _nc < WIDTH:
+                _bits |= 1 << _idx(_nr, _nc)
+        _ADJ_MASK.append(_bits)
+
+# Distância de Manhattan de cada deslocamento (dr, dc), calculada uma vez: DIST_LUT[dr + HEIGHT-1, dc + WIDTH-1]
+DIST_LUT = (np.abs(np.arange(1 - HEIGHT, HEIGHT))[:, None] + np.abs(np.arange(1 - WIDTH, WIDTH))[None, :]).astype(np.uint8)
+
+@functools.lru_cache(maxsize=None)
+def _disk_mask(idx, sight):
+    """Células a distância de Manhattan <= sight da célula idx (zona visível)."""
+    pr, pc = divmod(idx, WIDTH)
+    # Janela da LUT centrada no jogador: dá logo a distância de todas as células do mapa
+    dist = DIST_LUT[HEIGHT-1-pr : 2*HEIGHT-1-pr, WIDTH-1-pc : 2*WIDTH-1-pc]
+    return _mask_to_bits(dist <= sight)
+
+@functools.lru_cache(maxsize=64)
+def _load_pil(name, size):
+    """Lê e redimensiona um asset uma única vez (partilhado entre reinícios). Não alterar a imagem devolvida."""
+    path = os.path.join(ASSET_DIR, name)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{name} não existe")
+    return Image.open(path).convert("RGBA").resize((size, size))
 
 # --- 3. GESTÃO DE MEMÓRIA ---
 
+def _import_legacy_memory():
+    """Converte o histórico do ficheiro JSON antigo para o registo JSONL (só se este ainda não existir)."""
+    if os.path.exists(MEMORY_FILE) or not os.path.exists(LEGACY_MEMORY_FILE): return
+    try:
+        with open(LEGACY_MEMORY_FILE, "r", encoding="utf-8") as f:
+            conversations = json.load(f).get("conversations", [])
+    except (OSError, ValueError, AttributeError) as e:
+        print(f"Aviso: memória antiga não foi importada ({e}).")
+        return
+
+    lines = []
+    for conv in conversations:
+        player_msg, _, elira_text = str(conv).partition(" | E: ")
+        if player_msg.startswith("P: "): player_msg = player_msg[3:]
+        lines.append(_json_dumps({"p": player_msg, "e": elira_text}) + "\n")
+
+    # Escreve num ficheiro temporário e só depois troca: uma importação a meio não conta
+    tmp_path = MEMORY_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.writelines(lines)
+    os.replace(tmp_path, MEMORY_FILE)
+
 def load_memory():
+    """Lê só o fim do registo (as últimas conversas), sem carregar o histórico todo."""
+    conversations = []
     if os.path.exists(MEMORY_FILE):
         try:
-            with open(MEMORY_FILE, "r") as f:
-                return json.load(f)
-        except: pass
-    return {"conversations": [], "game_state": []}
+            with open(MEMORY_FILE, "r", encoding="utf-8") as f:
+                for line in collections.deque(f, maxlen=MEMORY_RECALL):
+                    try:
+                        entry = _json_loads(line)
+                        conversations.append(f"P: {entry['p']} | E: {entry['e']}")
+                    except (ValueError, KeyError): continue  # Linha estragada, ignora
+        except OSError: pass
+    return {"conversations": conversations, "game_state": []}
+
+def _memory_writer():
+    """Thread de escrita: cada conversa é uma linha acrescentada ao ficheiro (nunca reescreve tudo)."""
+    with open(MEMORY_FILE, "a", encoding="utf-8", buffering=1) as f:
+        while True:
+            line = _mem_queue.get()
+            if line is None: break  # Fim do programa: a fila já foi toda escrita
+            f.write(line)
+
+def _flush_memory():
+    """Ao sair, espera que a thread de escrita despeje o que ainda está na fila."""
+    _mem_queue.put(None)
+    _mem_thread.join(timeout=5)
 
-def save_memory(memory):
-    with open(MEMORY_FILE, "w") as f:
-        json.dump(memory, f, indent=2)
+def append_memory(player_msg, elira_text):
+    memory["conversations"].append(f"P: {player_msg} | E: {elira_text}")
+    _mem_queue.put_nowait(_json_dumps({"p": player_msg, "e": elira_text}) + "\n")
 
+_import_legacy_memory()
 memory = load_memory()
+_mem_queue = queue.Queue()
+_mem_thread = threading.Thread(target=_memory_writer, daemon=True)
+_mem_thread.start()
+atexit.register(_flush_memory)
 
 # --- 4. CLASSE PRINCIPAL DO JOGO ---
 
@@ -93,15 +345,29 @@ class GameGUI:
         self.hp = 100
         self.inventory = []
         self.game_over = False
-        self.triggered_traps = set()
+        self.triggered_bits = 0
 
         # --- NOVAS VARIAVEIS DE MAGIA ---
         self.sight_range = 2          # O alcance agora é variável
         self.magic_traps = False      # Ver armadilhas
         self.magic_treasures = False  # Ver tesouros ao longe
+
+        # --- LOOP ASSÍNCRONO (um só para todos os pedidos à API) ---
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.pending_spontaneous = None  # Último pedido espontâneo em curso
+        self.pending_chat = None         # Última pergunta do jogador em curso
+        self._req_gen = 0                # Geração da pergunta mais recente (as antigas são descartadas)
+        self._reply_cache = collections.OrderedDict()  # chave -> resposta (LRU)
+        self._semantic_cache = collections.deque(maxlen=REPLY_CACHE_SIZE)  # (estado, embedding, resposta)
+        self._stream_id = None  # Pedido cuja resposta está a aparecer no chat
+        self._spont_acc = collections.Counter()  # Passos dados desde a última reação ("w"/"a"/"s"/"d")
+        self._last_spont_t = float("-inf")
+        self._spont_job = None  # Reação adiada para o fim da janela
         
         # Gerar o Nível
-        self.walls, self.traps, self.treasures, self.exit_pos = self.generate_level()
+        self.walls_bits, self.traps_bits, self.treasures_bits, self.exit_pos = self.generate_level()
+        self.rebuild_distance_field()
         
         # Carregar Imagens
         self.load_assets()
@@ -121,6 +387,17 @@ class GameGUI:
                         bg="#202020", highlightthickness=0)
         self.canvas.pack()
 
+        # O mapa inteiro é uma só imagem: as células são coladas em PIL e o Canvas recebe um único blit
+        self.board_pil = Image.new("RGB", (WIDTH * CELL_SIZE, HEIGHT * CELL_SIZE))
+        self.board_photo = ImageTk.PhotoImage(self.board_pil)
+        self.board_item = self.canvas.create_image(0, 0, image=self.board_photo, anchor="nw")
+        self.player_item = self.canvas.create_image(0, 0, image=self.imgs["player"], anchor="nw")  # Por cima do mapa
+        self.dirty_bits = ALL_CELLS
+        self._painted = bytearray([255]) * (WIDTH * HEIGHT)  # Tipo de célula já colado no mapa (255 = nenhum)
+        self._prev_visible = self._visible_bits()
+        self._dirty = False          # Há alterações por desenhar?
+        self._redraw_job = None      # Redesenho já agendado (after_idle)
+
         # COLUNA DA DIREITA (NPC + CHAT + STATUS)
         right_frame = tk.Frame(main_container, bg="#1a1a1a")
         right_frame.pack(side=tk.LEFT, fill="both", expand=True)
@@ -142,6 +419,7 @@ class GameGUI:
         self.chat_log = scrolledtext.ScrolledText(right_frame, height=15, width=40, state='disabled', 
                                                   bg="#2b2b2b", fg="#e0e0e0", font=("Verdana", 9), insertbackground="white")
         self.chat_log.pack(pady=5)
+        self._log_lines = 0  # Linhas no chat (só ficam as últimas LOG_MAX_LINES)
         
         # Tags de cor (Copia as mesmas de antes)
         self.chat_log.tag_config("player", foreground="#5dade2")
@@ -173,84 +451,97 @@ class GameGUI:
         master.bind("<Right>", lambda e: self.move_player("d"))
 
         # --- 6. ARRANQUE (Isto também faltava!) ---
-        # Thread de animação da Elira
-        threading.Thread(target=self.idle_animation, daemon=True).start()
+        # Animação da Elira (corre no próprio loop do Tk, sem thread)
+        self.root.after(5000, self._tick_idle)
 
         # Desenhar o mapa pela primeira vez (para não começar preto)
         self.draw_grid()
         self.log_message("System: Welcome to the Dark Library.", "system")
 
     def play_magic_sound(self, spell_type):
-        """Gera sons sintéticos para os feitiços."""
-        def sound_thread():
-            if spell_type == "revelio":
-                # Som agudo e rápido (Revelação)
-                winsound.Beep(1000, 100)
-                winsound.Beep(1500, 100)
-                winsound.Beep(2000, 200)
-            elif spell_type == "aurum":
-                # Som de moeda (Ouro)
-                winsound.Beep(2500, 100)
-                winsound.Beep(4000, 300)
-            elif spell_type == "lumen":
-                # Som grave para agudo (Luz a expandir)
-                for freq in range(400, 1000, 100):
-                    winsound.Beep(freq, 40)
-        
-        threading.Thread(target=sound_thread, daemon=True).start()
+        """Toca o som (pré-gerado) do feitiço, sem bloquear."""
+        play_sound(spell_type)
 
     def generate_level(self):
         """Gera mapa e escolhe uma SAÍDA aleatória longe do jogador."""
-        walls, traps, treasures = set(), set(), set()
-        
-        # 1. Gera o recheio (paredes/traps)
-        empty_spots = [] # Lista para guardar sítios livres
-        
-        for r in range(HEIGHT):
-            for c in range(WIDTH):
-                if (r, c) == (0, 0): continue # Pula o jogador
-                
-                chance = random.random()
-                if chance < 0.2: walls.add((r, c))
-                elif chance < 0.25: traps.add((r, c))
-                elif chance > 0.97: treasures.add((r, c))
-                else:
-                    empty_spots.append((r, c)) # Guardar chão vazio
+        # 1. Gera o recheio (paredes/traps) de uma só vez, com máscaras sobre um sorteio do mapa inteiro
+        chance = np.random.random((HEIGHT, WIDTH))
+        chance[0, 0] = 0.5  # Pula o jogador (fica chão vazio)
+
+        walls_mask = chance < 0.2
+        traps_mask = (chance >= 0.2) & (chance < 0.25)
+        treasures_mask = chance > 0.97
+        empty_mask = ~(walls_mask | traps_mask | treasures_mask)
+        empty_mask[0, 0] = False  # Sítios livres (sem contar o jogador)
+
+        walls = _mask_to_bits(walls_mask)
+        traps = _mask_to_bits(traps_mask)
+        treasures = _mask_to_bits(treasures_mask)
 
         # 2. Define a Saída num sitio vazio aleatório (e remove parede se houver azar)
-        if empty_spots:
-            self.exit_pos = random.choice(empty_spots)
+        empty_spots = np.flatnonzero(empty_mask)
+        if empty_spots.size:
+            self.exit_pos = divmod(int(np.random.choice(empty_spots)), WIDTH)
         else:
             self.exit_pos = (HEIGHT-1, WIDTH-1) # Fallback
 
         # Garante que não há parede/trap/tesouro em cima da saída
-        if self.exit_pos in walls: walls.remove(self.exit_pos)
-        if self.exit_pos in traps: traps.remove(self.exit_pos)
-        if self.exit_pos in treasures: treasures.remove(self.exit_pos)
+        exit_bit = 1 << _idx(*self.exit_pos)
+        walls &= ~exit_bit
+        traps &= ~exit_bit
+        treasures &= ~exit_bit
 
         # Garante pelo menos 1 tesouro
-        if not treasures: treasures.add((HEIGHT//2, WIDTH//2))
+        if not treasures: treasures = 1 << _idx(HEIGHT//2, WIDTH//2)
         
         return walls, traps, treasures, self.exit_pos
 
+    def rebuild_distance_field(self):
+        """BFS multi-fonte a partir do alvo (todos os tesouros, ou a saída) que contorna as paredes.
+
+        Guarda a distância real (em passos) de cada célula ao alvo mais perto e, por célula,
+        uma direção N/S/W/E que a aproxima dele (a primeira encontrada, para o prompt
+        nunca dizer coisas como "North-South").
+        """
+        targets = self.treasures_bits if self.treasures_bits else 1 << _idx(*self.exit_pos)
+        dist = [DIST_UNREACHABLE] * (WIDTH * HEIGHT)
+        hint = [0] * (WIDTH * HEIGHT)
+
+        frontier = collections.deque()
+        for idx in _iter_bits(targets):
+            dist[idx] = 0
+            frontier.append(divmod(idx, WIDTH))
+
+        while frontier:
+            r, c = frontier.popleft()
+            d = dist[r * WIDTH + c] + 1
+            # (dr, dc, direção que leva do vizinho de volta a esta célula)
+            for dr, dc, back in ((-1, 0, DIR_SOUTH), (1, 0, DIR_NORTH), (0, -1, DIR_EAST), (0, 1, DIR_WEST)):
+                nr, nc = r + dr, c + dc
+                if not (0 <= nr < HEIGHT and 0 <= nc < WIDTH):
+                    continue
+                n_idx = _idx(nr, nc)
+                if self.walls_bits >> n_idx & 1:
+                    continue
+                if dist[n_idx] == DIST_UNREACHABLE:
+                    dist[n_idx] = d
+                    hint[n_idx] = back
+                    frontier.append((nr, nc))
+
+        self._dist_to_target = np.array(dist, dtype=np.uint16)
+        self._dir_hint = np.array(hint, dtype=np.uint8)
+
     def load_assets(self):
         """Tenta carregar imagens. Se der erro, cria quadrados coloridos."""
         def load_img(name, color="magenta"):
             try:
-                path = os.path.join(ASSET_DIR, name)
-                if not os.path.exists(path):
-                    raise FileNotFoundError(f"{name} não existe")
-                
-                # Carrega e converte
-                pil_img = Image.open(path).convert("RGBA").resize((CELL_SIZE, CELL_SIZE))
-                return ImageTk.PhotoImage(pil_img)
+                return _load_pil(name, CELL_SIZE)
             except Exception as e:
                 print(f"Asset Error ({name}): {e}. Usando quadrado {color}.")
                 # Fallback: Quadrado Sólido
-                fallback = Image.new('RGB', (CELL_SIZE, CELL_SIZE), color=color)
-                return ImageTk.PhotoImage(fallback)
+                return Image.new('RGBA', (CELL_SIZE, CELL_SIZE), color=color)
         
-        self.imgs = {
+        pil = {
             "player": load_img("player.png", "cyan"),
             "wall": load_img("wall.png", "gray"),
             "treasure": load_img("treasure.png", "gold"),
@@ -261,71 +552,127 @@ class GameGUI:
             "encouraging": load_img("npc_encouraging.png", "pink"),
             "trap": load_img("trap.png", "red"),
         }
+        self.imgs = {name: ImageTk.PhotoImage(img) for name, img in pil.items()}
+        self.build_tiles(pil)
+
+    def build_tiles(self, pil):
+        """Pré-compõe (em PIL) cada tipo de célula do mapa."""
+        def tile(fill, outline):
+            img = Image.new("RGBA", (CELL_SIZE, CELL_SIZE))
+            ImageDraw.Draw(img).rectangle([0, 0, CELL_SIZE - 1, CELL_SIZE - 1], fill=fill, outline=outline)
+            return img
+
+        floor = tile("#2c3e50", "#34495e")
+
+        exit_tile = floor.copy()
+        ImageDraw.Draw(exit_tile).rectangle([5, 5, CELL_SIZE - 5, CELL_SIZE - 5], fill="#8e44ad", outline="white", width=2)
+
+        wall = Image.alpha_composite(tile("#7f8c8d", "black"), pil["wall"])
+        trap = Image.alpha_composite(floor, pil["trap"])
+
+        treasure = floor.copy()
+        ImageDraw.Draw(treasure).ellipse([10, 10, CELL_SIZE - 10, CELL_SIZE - 10], fill="#f1c40f", outline="black")
+        treasure = Image.alpha_composite(treasure, pil["treasure"])
+
+        tiles = [None] * 7
+        tiles[TILE_FOG] = tile("black", "black")
+        tiles[TILE_GOLD] = tile("#f39c12", "black")  # Tesouro visto ao longe (Aurum)
+        tiles[TILE_FLOOR] = floor
+        tiles[TILE_EXIT] = exit_tile
+        tiles[TILE_WALL] = wall
+        tiles[TILE_TRAP] = trap
+        tiles[TILE_TREASURE] = treasure
+        self.tiles = [img.convert("RGB") for img in tiles]
 
     def log_message(self, text, tag=None):
+        self.log_lines((text, tag))
+
+    def log_lines(self, *entries):
+        """Escreve várias linhas (texto, tag) de uma vez e corta as mais antigas do chat."""
+        args = []
+        for text, tag in entries:
+            args += [text + "\n", tag]
         self.chat_log.config(state='normal')
-        self.chat_log.insert(tk.END, text + "\n", tag)
+        if self._stream_id is not None:
+            # Há uma resposta a meio: as linhas novas entram antes dela (que continua a ser a última)
+            self.chat_log.mark_gravity("stream_start", tk.RIGHT)
+            self.chat_log.insert("stream_start", *args)
+            self.chat_log.mark_gravity("stream_start", tk.LEFT)
+        else:
+            self.chat_log.insert(tk.END, *args)
+        self._log_lines += sum(text.count("\n") + 1 for text, _ in entries)
+        if self._log_lines > LOG_MAX_LINES:
+            excess = self._log_lines - LOG_MAX_LINES
+            self.chat_log.delete("1.0", f"{excess + 1}.0")
+            self._log_lines = LOG_MAX_LINES
         self.chat_log.see(tk.END)
         self.chat_log.config(state='disabled')
 
-    def draw_grid(self):
-        self.canvas.delete("tile")
-        
-        # Garante alcance mínimo de 2 se a variável falhar
-        current_sight = getattr(self, "sight_range", 2)
+    def mark_all_dirty(self):
+        self.dirty_bits = ALL_CELLS
+
+    def _visible_bits(self):
+        """Disco de Manhattan (alcance de visão) à volta do jogador."""
+        return _disk_mask(_idx(*self.player_pos), getattr(self, "sight_range", 2))
+
+    def update_fog(self):
+        """Só as células que entraram ou saíram da visão mudam de aspeto."""
+        new_visible = self._visible_bits()
+        self.dirty_bits |= new_visible ^ self._prev_visible
+        self._prev_visible = new_visible
+
+    def cell_tile(self, idx):
+        """Tipo (TILE_*) de uma célula, com as mesmas regras de visibilidade de sempre."""
+        bit = 1 << idx
+
+        # 1. ZONA ESCURA (Fog of War)
+        if not self._prev_visible & bit:
+            # Se tiver magia "Aurum", vê tesouros ao longe a amarelo
+            if getattr(self, "magic_treasures", False) and self.treasures_bits & bit:
+                return TILE_GOLD
+            return TILE_FOG
+
+        # 2. OBJETOS (Se chegou aqui, é visível)
+        if idx == _idx(*self.exit_pos): return TILE_EXIT
+        if self.walls_bits & bit: return TILE_WALL
+        if self.traps_bits & bit:
+            # Armadilhas (Só se reveladas)
+            show_trap = self.triggered_bits & bit or getattr(self, "magic_traps", False)
+            return TILE_TRAP if show_trap else TILE_FLOOR
+        if self.treasures_bits & bit: return TILE_TREASURE
+        return TILE_FLOOR
 
-        for r in range(HEIGHT):
-            for c in range(WIDTH):
-                x, y = c * CELL_SIZE, r * CELL_SIZE
-                dist = abs(self.player_pos[0] - r) + abs(self.player_pos[1] - c)
-                
-                # --- LÓGICA DE VISIBILIDADE ---
-                is_visible = dist <= current_sight
-                
-                # 1. ZONA ESCURA (Fog of War)
-                if not is_visible:
-                    # Se tiver magia "Aurum", vê tesouros ao longe a amarelo
-                    if getattr(self, "magic_treasures", False) and (r, c) in self.treasures:
-                        self.canvas.create_rectangle(x, y, x + CELL_SIZE, y + CELL_SIZE, fill="#f39c12", outline="black", tags="tile")
-                    else:
-                        # Desenha Preto (Escuridão) e salta para o próximo bloco
-                        self.canvas.create_rectangle(x, y, x + CELL_SIZE, y + CELL_SIZE, fill="black", outline="black", tags="tile")
-                    continue 
-
-                # 2. CHÃO (Se chegou aqui, é visível)
-                # Desenha um quadrado azul escuro (Base)
-                self.canvas.create_rectangle(x, y, x + CELL_SIZE, y + CELL_SIZE, fill="#2c3e50", outline="#34495e", tags="tile")
-
-                # 3. OBJETOS (Desenha Cor de Fundo + Imagem)
-                
-                # Portal de Saída
-                if (r, c) == self.exit_pos:
-                     self.canvas.create_rectangle(x+5, y+5, x+CELL_SIZE-5, y+CELL_SIZE-5, fill="#8e44ad", outline="white", width=2, tags="tile")
-
-                # Paredes
-                elif (r, c) in self.walls:
-                    # Fundo Cinzento + Imagem
-                    self.canvas.create_rectangle(x, y, x+CELL_SIZE, y+CELL_SIZE, fill="#7f8c8d", tags="tile")
-                    if self.imgs.get("wall"):
-                        self.canvas.create_image(x + CELL_SIZE // 2, y + CELL_SIZE // 2, image=self.imgs["wall"], tags="tile")
-                
-                # Armadilhas (Só se reveladas)
-                elif (r, c) in self.traps:
-                    show_trap = (r,c) in self.triggered_traps or getattr(self, "magic_traps", False)
-                    if show_trap:
-                        if self.imgs.get("trap"):
-                            self.canvas.create_image(x + CELL_SIZE // 2, y + CELL_SIZE // 2, image=self.imgs["trap"], tags="tile")
-                
-                # Tesouros
-                elif (r, c) in self.treasures:
-                    self.canvas.create_oval(x+10, y+10, x+CELL_SIZE-10, y+CELL_SIZE-10, fill="#f1c40f", tags="tile")
-                    if self.imgs.get("treasure"):
-                        self.canvas.create_image(x + CELL_SIZE // 2, y + CELL_SIZE // 2, image=self.imgs["treasure"], tags="tile")
-
-        # 4. JOGADOR
-        px, py = self.player_pos[1] * CELL_SIZE, self.player_pos[0] * CELL_SIZE
-        if self.imgs.get("player"):
-            self.canvas.create_image(px + CELL_SIZE // 2, py + CELL_SIZE // 2, image=self.imgs["player"], tags="tile")
+    def draw_grid(self):
+        """Recompõe só as células sujas na imagem do mapa e faz um único blit para o Canvas."""
+        self.update_fog()
+        changed = False
+        for idx in _iter_bits(self.dirty_bits):
+            tile_id = self.cell_tile(idx)
+            if self._painted[idx] == tile_id: continue  # Já está desenhada assim
+            self._painted[idx] = tile_id
+            r, c = divmod(idx, WIDTH)
+            self.board_pil.paste(self.tiles[tile_id], (c * CELL_SIZE, r * CELL_SIZE))
+            changed = True
+        self.dirty_bits = 0
+
+        if changed:
+            self.board_photo.paste(self.board_pil)
+            self.canvas.itemconfig(self.board_item, image=self.board_photo)
+
+        # JOGADOR: um só item, apenas muda de sítio
+        self.canvas.coords(self.player_item, self.player_pos[1] * CELL_SIZE, self.player_pos[0] * CELL_SIZE)
+
+    def _schedule_redraw(self):
+        """Pede um redesenho; vários pedidos seguidos (autorepeat das setas) dão um só desenho."""
+        self._dirty = True
+        if self._redraw_job is None:
+            self._redraw_job = self.root.after_idle(self._flush_redraw)
+
+    def _flush_redraw(self):
+        self._redraw_job = None
+        if self._dirty:
+            self._dirty = False
+            self.draw_grid()
 
     
     def update_status(self):
@@ -333,8 +680,8 @@ class GameGUI:
         color = "#00ff00" if self.hp > 50 else "#ff0000"
         self.status_var.set(f"HP: {self.hp}% | {inv_text}")
         self.status_label.config(fg=color)
-        if self.treasures:
-            self.objective_label.config(text=f"OBJETIVO: Faltam {len(self.treasures)} tesouros!", fg="#00ffff")
+        if self.treasures_bits:
+            self.objective_label.config(text=f"OBJETIVO: Faltam {self.treasures_bits.bit_count()} tesouros!", fg="#00ffff")
         else:
             self.objective_label.config(text="OBJETIVO: FOGE PELO PORTAL (AMARELO)!", fg="yellow")
 
@@ -349,17 +696,19 @@ class GameGUI:
         elif cmd == "d": new_c += 1
 
         moved = False
-        if 0 <= new_r < HEIGHT and 0 <= new_c < WIDTH and (new_r, new_c) not in self.walls:
+        if 0 <= new_r < HEIGHT and 0 <= new_c < WIDTH and not self.walls_bits >> _idx(new_r, new_c) & 1:
             self.player_pos[:] = [new_r, new_c]
             moved = True
 
             curr_pos = tuple(self.player_pos)
+            curr_bit = 1 << _idx(new_r, new_c)
 
-            if curr_pos in self.traps:
-                self.triggered_traps.add(curr_pos)
+            if self.traps_bits & curr_bit:
+                self.triggered_bits |= curr_bit
+                self.dirty_bits |= curr_bit  # A armadilha passa a ficar à vista
                 damage = 25
                 self.hp -= damage
-                self.log_message(f"💥 TRAP! -{damage} HP!", "danger")
+                lines = [(f"💥 TRAP! -{damage} HP!", "danger")]
                 speak_text("Trap! Watch out!")
                 self.player_pos[:] = [0, 0] 
                 
@@ -367,26 +716,29 @@ class GameGUI:
                 if self.hp <= 0:
                     self.hp = 0
                     self.game_over = True
-                    self.log_message("💀 GAME OVER.", "danger")
+                    lines.append(("💀 GAME OVER.", "danger"))
                     speak_text("No... please... don't die.")
                     
                     # ADICIONA ESTA LINHA:
                     self.root.after(1000, lambda: self.show_end_screen(victory=False))
+                self.log_lines(*lines)  # Uma só escrita no chat
 
-            elif curr_pos in self.treasures:
-                self.treasures.remove(curr_pos)
+            elif self.treasures_bits & curr_bit:
+                self.treasures_bits &= ~curr_bit
+                self.dirty_bits |= curr_bit
+                self.rebuild_distance_field()  # O alvo mudou (outro tesouro ou a saída)
                 item_name = random.choice(["Ancient Scroll", "Golden Chalice", "Mana Crystal"])
                 self.inventory.append(item_name)
                 self.log_message(f"✨ Found: {item_name}!", "success")
                 
-                if not self.treasures:
+                if not self.treasures_bits:
                     speak_text("That's the last one! Quick, to the portal!")
                 else:
                     speak_text("A treasure! Need more though.")
 
             # --- NOVA LÓGICA DE SAÍDA ---
             elif curr_pos == self.exit_pos:
-                if not self.treasures:
+                if not self.treasures_bits:
                     self.log_message("🌌 PORTAL OPENED! YOU ESCAPED!", "success")
                     speak_text("We are free! The light... it's beautiful!")
                     self.root.after(1000, lambda: self.show_end_screen(victory=True))
@@ -396,53 +748,28 @@ class GameGUI:
                     speak_text("The portal is sealed. We need all the artifacts to open it.")
 
         self.update_status()
-        self.draw_grid()
+        self._schedule_redraw()
 
         if moved and not self.game_over:
-            self.spontaneous_npc_reaction()
+            self.spontaneous_npc_reaction(cmd)
 
     def get_proximity_status(self):
         pr, pc = self.player_pos
         status = []
         
-        # 1. Onde ir (Tesouro ou Saída?)
-        target = None
-        target_name = ""
-        
-        if self.treasures:
-            # Procura tesouro mais perto
-            nearest_dist = float('inf')
-            for tr, tc in self.treasures:
-                d = abs(tr - pr) + abs(tc - pc)
-                if d < nearest_dist:
-                    nearest_dist = d
-                    target = (tr, tc)
-            target_name = "Treasure"
+        # 1. Onde ir (Tesouro ou Saída?) - lido do mapa de distâncias, sem procurar
+        target_name = "Treasure" if self.treasures_bits else "EXIT PORTAL"
+        idx = _idx(pr, pc)
+        steps = int(self._dist_to_target[idx])
+
+        if steps == 0: status.append(f"GOAL REACHED: We are at the {target_name}!")
+        elif steps == DIST_UNREACHABLE: status.append(f"GUIDANCE: No path to the {target_name} from here.")
         else:
-            # Se não há tesouros, o alvo é a SAÍDA
-            target = self.exit_pos
-            target_name = "EXIT PORTAL"
-
-        # Calcular direção para o alvo
-        if target:
-            tr, tc = target
-            d_lat = tr - pr
-            d_lon = tc - pc
-            dirs = []
-            if d_lat < 0: dirs.append("North")
-            elif d_lat > 0: dirs.append("South")
-            if d_lon < 0: dirs.append("West")
-            elif d_lon > 0: dirs.append("East")
-            
-            steps = abs(d_lat) + abs(d_lon)
-            if steps == 0: status.append(f"GOAL REACHED: We are at the {target_name}!")
-            else: status.append(f"GUIDANCE: {target_name} is to the {'-'.join(dirs)} ({steps} steps).")
+            direction = DIR_NAMES[int(self._dir_hint[idx])]
+            status.append(f"GUIDANCE: {target_name} is to the {direction} ({steps} steps).")
 
         # 2. Sentido de Perigo
-        nearby_traps = 0
-        for dr, dc in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-            if (pr + dr, pc + dc) in self.traps:
-                nearby_traps += 1
+        nearby_traps = (self.traps_bits & _ADJ_MASK[idx]).bit_count()
         if nearby_traps > 0:
             status.append(f"WARNING: {nearby_traps} hidden trap(s) ADJACENT!")
 
@@ -464,7 +791,8 @@ class GameGUI:
             self.play_magic_sound("revelio")
             self.log_message("✨ SPELL CAST: Traps revealed!", "success")
             speak_text("Behold! The snares are revealed.")
-            self.draw_grid()
+            self.dirty_bits |= self._prev_visible
+            self._schedule_redraw()
             return # Não envia para a IA
 
         elif "aurum" in msg_low: # Poder 2: Ver Tesouro Amarelo
@@ -472,7 +800,8 @@ class GameGUI:
             self.play_magic_sound("aurum")
             self.log_message("✨ SPELL CAST: Gold glitters in the dark!", "success")
             speak_text("Can you see the gold shining?")
-            self.draw_grid()
+            self.dirty_bits |= self.treasures_bits
+            self._schedule_redraw()
             return
 
         elif "lumen" in msg_low: # Poder 3: Aumentar Visão
@@ -480,7 +809,7 @@ class GameGUI:
             self.play_magic_sound("lumen")
             self.log_message("✨ SPELL CAST: Light expands!", "success")
             speak_text("Let there be light.")
-            self.draw_grid()
+            self._schedule_redraw()
             return
 
         # Se não for magia, chama a thread:
@@ -511,8 +840,27 @@ class GameGUI:
         """
         messagebox.showinfo("Grimoire", info)
 
-    def spontaneous_npc_reaction(self):
-        self.run_npc_thread("", True)
+    def spontaneous_npc_reaction(self, cmd):
+        """Acumula os passos e pede no máximo uma reação por SPONTANEOUS_INTERVAL segundos."""
+        self._spont_acc[cmd] += 1
+        wait = self._last_spont_t + SPONTANEOUS_INTERVAL - time.monotonic()
+        if wait > 0:
+            # Ainda é cedo: os passos ficam guardados e a reação sai no fim da janela
+            if self._spont_job is None:
+                self._spont_job = self.root.after(int(wait * 1000), self._flush_spontaneous)
+            return
+        self._flush_spontaneous()
+
+    def _flush_spontaneous(self):
+        """Um só pedido para todos os passos acumulados ("moved 5x, net East")."""
+        self._spont_job = None
+        if self.game_over or not self._spont_acc: return
+        moves, self._spont_acc = self._spont_acc, collections.Counter()
+        self._last_spont_t = time.monotonic()
+
+        dy, dx = moves["s"] - moves["w"], moves["d"] - moves["a"]
+        net = " ".join(name for name, n in (("North", -dy), ("South", dy), ("West", -dx), ("East", dx)) if n > 0)
+        self.run_npc_thread("", True, f"Player moved {sum(moves.values())}x, net {net or 'nowhere'}.")
 
     def reset_game(self):
         """Reinicia todo o estado do jogo."""
@@ -520,96 +868,202 @@ class GameGUI:
         self.hp = 100
         self.inventory = []
         self.game_over = False
-        self.triggered_traps = set()
+        self.triggered_bits = 0
         self.player_pos = [0, 0]
 
         self.sight_range = 2
         self.magic_traps = False
         self.magic_treasures = False
+        self._spont_acc.clear()  # Passos do jogo anterior já não contam
         
         # Gerar novo mapa (Isto muda as paredes e tesouros de sitio!_get_npc_reply)
-        self.walls, self.traps, self.treasures, self.exit_pos = self.generate_level()
+        self.walls_bits, self.traps_bits, self.treasures_bits, self.exit_pos = self.generate_level()
+        self.rebuild_distance_field()
         
         # Limpar Chat
+        self._end_stream(self._stream_id)
         self.chat_log.config(state='normal')
         self.chat_log.delete(1.0, tk.END)
         self.chat_log.config(state='disabled')
+        self._log_lines = 0
         
         # Atualizar Ecrã
         self.log_message("System: --- GAME RESTARTED ---", "system")
         speak_text("Let's try again. Be careful this time.")
-        self.draw_grid()
+        self.mark_all_dirty()
+        self._schedule_redraw()
         self.update_status()
 
-    # 1. Função que prepara e lança a thread (Não bloqueia o jogo)
-    def run_npc_thread(self, player_msg, is_spontaneous):
-        def task():
+    # 1. Função que prepara e lança o pedido no loop assíncrono (Não bloqueia o jogo)
+    def run_npc_thread(self, player_msg, is_spontaneous, moves=None):
+        stream_id = object()  # Identifica a linha deste pedido no chat
+        gen = None
+        if not is_spontaneous:
+            self._req_gen += 1
+            gen = self._req_gen
+
+        async def task():
             game_status = self.get_proximity_status()
             hist_list = memory.get("conversations", [])
-            recent_history = "\n".join(hist_list[-5:])
+            recent = hist_list[-HISTORY_TURNS:]
+            recent_history = "\n".join(line[:HISTORY_CHARS] for line in recent)
             
             # Ajuste para evitar falhas se a mensagem for vazia
             safe_msg = player_msg.replace('"', "'") # Troca aspas duplas por simples para não partir o JSON
             
             if is_spontaneous:
-                context = "Player moved. React quickly."
+                context = f"{moves or 'Player moved.'} React quickly."
                 max_tok = 60
             else:
                 context = f"CONVERSATION: Player said: '{safe_msg}'. Reply/Roleplay."
                 max_tok = 150
 
-            prompt = f"""
-SYSTEM: You are Elira.
-HP: {self.hp}%
-STATUS: {game_status}
-INSTRUCTIONS: Return VALID JSON ONLY. No markdown.
-MEMORY: {recent_history}
-CONTEXT: {context}
-OUTPUT JSON: {{ "text": "...", "emotion": "idle/happy/anxious" }}
-"""
+            # Cache: se já respondemos a esta situação, não gasta um pedido à API
+            key = (is_spontaneous, self.hp // 10, game_status, hash(tuple(recent)), safe_msg)
+            state = (self.hp // 10, game_status)  # Uma frase parecida só serve se o jogo estiver igual
+            embedding = None
+            cached = self._reply_cache.get(key)
+            if cached is not None:
+                self._reply_cache.move_to_end(key)
+            elif not is_spontaneous:
+                embedding = await asyncio.to_thread(_embed, safe_msg)
+                if embedding is not None:
+                    cached = self._semantic_lookup(state, embedding)
+            if cached is not None:
+                print("--- (Cache) Resposta reaproveitada ---")
+                self.root.after(0, lambda: self.finalize_npc_reply(player_msg, cached, is_spontaneous, None, gen))
+                return
+
+            user_msg = f"HP:{self.hp}% STATUS:{game_status} MEMORY:{recent_history} CTX:{context}"
             try:
-                print(f"--- (Thread) A enviar pedido... ---") 
+                print(f"--- (Async) A enviar pedido... ---") 
                 
-                # Chamada à API
-                response = client.chat.completions.create(
-                    model=MODEL,
-                    messages=[{"role": "user", "content": prompt}],
-                    max_tokens=max_tok, 
-                    temperature=0.8
-                )
-                
-                content = response.choices[0].message.content.strip()
-                print(f"--- (Thread) Recebido: {content[:50]}... ---") # Mostra só o inicio
-
-                # Limpeza do JSON (caso a IA ponha ```json no inicio)
-                if content.startswith("```"):
-                    content = content.replace("```json", "").replace("```", "")
-                
-                try:
-                    data = json.loads(content)
-                except json.JSONDecodeError:
-                    # Se falhar o JSON, usa o texto direto
-                    print("--- JSON falhou, a usar texto direto ---")
+                # Chamada à API (não bloqueia: o loop pode ter vários pedidos em voo)
+                if is_spontaneous:
+                    # Reação curta: modo JSON estrito, sem streaming nem limpezas
+                    response = await _call_groq(user_msg, max_tok, stream=False)
+                    content = (response.choices[0].message.content or "").strip()
+                    print(f"--- (Async) Recebido: {content[:50]}... ---") # Mostra só o inicio
+                    try:
+                        data = _json_loads(content)
+                    except ValueError:
+                        data = None  # Tratado abaixo como texto direto
+                else:
+                    stream = await _call_groq(user_msg, max_tok)
+                    self.root.after(0, self._begin_stream, stream_id)
+
+                    # Vai mostrando o "text" no chat enquanto o resto do JSON chega
+                    chunks, shown = [], 0
+                    async for chunk in stream:
+                        delta = chunk.choices[0].delta.content if chunk.choices else None
+                        if not delta: continue
+                        chunks.append(delta)
+                        visible = _partial_text("".join(chunks))
+                        if len(visible) > shown:
+                            self.root.after(0, self._append_stream_chunk, stream_id, visible[shown:])
+                            shown = len(visible)
+
+                    content = "".join(chunks).strip()
+                    print(f"--- (Async) Recebido: {content[:50]}... ---") # Mostra só o inicio
+
+                    # Limpeza do JSON (caso a IA ponha ```json no inicio)
+                    if content.startswith("```"):
+                        content = content.replace("```json", "").replace("```", "")
+
+                    try:
+                        data = _json_loads(content)
+                    except ValueError:  # json.JSONDecodeError / orjson.JSONDecodeError
+                        # Se falhar o JSON, usa o texto direto
+                        print("--- JSON falhou, a usar texto direto ---")
+                        data = {"text": content, "emotion": "idle"}
+
+                # O modo JSON só garante sintaxe válida, não o formato {"text", "emotion"}
+                if not (isinstance(data, dict) and isinstance(data.get("text"), str)):
+                    print("--- Resposta sem campo text, a usar texto direto ---")
                     data = {"text": content, "emotion": "idle"}
 
-                self.root.after(0, lambda: self.finalize_npc_reply(player_msg, data, is_spontaneous))
+                self._cache_reply(key, state, embedding, data)
+                self.root.after(0, lambda: self.finalize_npc_reply(player_msg, data, is_spontaneous, stream_id, gen))
 
+            except asyncio.CancelledError:
+                # Substituído por um pedido mais recente: apaga o que já tinha escrito
+                self.root.after(0, self._end_stream, stream_id)
+                raise
             except Exception as e:
                 print(f"❌ ERRO API: {e}")
                 err_data = {"text": "A minha mente está nevoada...", "emotion": "anxious"}
-                self.root.after(0, lambda: self.finalize_npc_reply(player_msg, err_data, is_spontaneous))
+                self.root.after(0, lambda: self.finalize_npc_reply(player_msg, err_data, is_spontaneous, stream_id, gen))
+
+        # Só o pedido mais recente de cada tipo interessa: cancela o anterior se ainda estiver em voo
+        # (fecha o stream e liberta a ligação mais cedo)
+        previous = self.pending_spontaneous if is_spontaneous else self.pending_chat
+        if previous and not previous.done():
+            previous.cancel()
 
-        threading.Thread(target=task, daemon=True).start()
+        future = asyncio.run_coroutine_threadsafe(task(), self.loop)
+        if is_spontaneous:
+            self.pending_spontaneous = future
+        else:
+            self.pending_chat = future
+
+    def _semantic_lookup(self, state, embedding):
+        """Resposta guardada para a frase mais parecida (acima do limiar) no mesmo estado (HP, status), ou None."""
+        best, best_sim = None, SEMANTIC_THRESHOLD
+        for other_state, other, data in self._semantic_cache:
+            if other_state != state: continue  # Outro HP/posição: a resposta antiga já não é verdade
+            sim = float(embedding @ other)
+            if sim >= best_sim:
+                best, best_sim = data, sim
+        return best
+
+    def _cache_reply(self, key, state, embedding, data):
+        self._reply_cache[key] = data
+        if len(self._reply_cache) > REPLY_CACHE_SIZE:
+            self._reply_cache.popitem(last=False)  # Remove a mais antiga
+        if embedding is not None:
+            self._semantic_cache.append((state, embedding, data))
 
     # 2. Função que recebe a resposta e atualiza o ecrã (Rodando no Thread Principal)
-    def finalize_npc_reply(self, player_msg, data, is_spontaneous):
+    def finalize_npc_reply(self, player_msg, data, is_spontaneous, stream_id=None, gen=None):
+        # A linha parcial do streaming dá lugar à resposta final
+        self._end_stream(stream_id)
+        if gen is not None and gen != self._req_gen: return  # Resposta a uma pergunta já ultrapassada
         if not is_spontaneous:
-            memory["conversations"].append(f"P: {player_msg} | E: {data['text']}")
+            append_memory(player_msg, data["text"])
         
         self.log_message(f"Elira: {data['text']}", "elira")
         self.animate_npc(data.get("emotion", "idle"))
         speak_text(data["text"])
 
+    # Streaming: a linha da Elira vai crescendo no chat (só a do pedido mais recente)
+    def _begin_stream(self, stream_id):
+        self._end_stream(self._stream_id)
+        self._stream_id = stream_id
+        self.npc_label.configure(image=self.imgs["thinking"])  # "A escrever..."
+
+        self.chat_log.config(state='normal')
+        self.chat_log.mark_set("stream_start", "end-1c")
+        self.chat_log.mark_gravity("stream_start", tk.LEFT)
+        self.chat_log.insert(tk.END, "Elira: ", "elira")
+        self.chat_log.see(tk.END)
+        self.chat_log.config(state='disabled')
+
+    def _append_stream_chunk(self, stream_id, text):
+        if stream_id is None or stream_id != self._stream_id: return
+        self.chat_log.config(state='normal')
+        self.chat_log.insert(tk.END, text, "elira")
+        self.chat_log.see(tk.END)
+        self.chat_log.config(state='disabled')
+
+    def _end_stream(self, stream_id):
+        """Apaga a linha parcial deste pedido (se ainda for a que está a ser escrita)."""
+        if stream_id is None or stream_id != self._stream_id: return
+        self._stream_id = None
+        self.npc_label.configure(image=self.imgs["idle"])
+        self.chat_log.config(state='normal')
+        self.chat_log.delete("stream_start", tk.END)
+        self.chat_log.config(state='disabled')
+
     # Substitui o animate_npc antigo por este:
     def animate_npc(self, emotion):
         # Agora alteramos a imagem do Label lateral
@@ -617,11 +1071,10 @@ OUTPUT JSON: {{ "text": "...", "emotion": "idle/happy/anxious" }}
         self.npc_label.configure(image=img) 
         self.root.after(2000, lambda: self.npc_label.configure(image=self.imgs["idle"]))
 
-    def idle_animation(self):
-        while True:
-            time.sleep(random.randint(4, 8))
-            if not self.game_over:
-                self.animate_npc("idle")
+    def _tick_idle(self):
+        if not self.game_over:
+            self.animate_npc("idle")
+        self.root.after(random.randint(4000, 8000), self._tick_idle)
 
     def show_end_screen(self, victory):
         """Esconde o jogo e mostra uma janela de Fim dedicada."""
@@ -674,17 +1127,7 @@ OUTPUT JSON: {{ "text": "...", "emotion": "idle/happy/anxious" }}
                   font=("Arial", 10), bg=bg_color, fg=fg_color, relief="flat").pack(pady=5)
 
         # Som
-        def play_sound():
-            try:
-                if victory:
-                    winsound.Beep(600, 100)
-                    winsound.Beep(800, 100)
-                    winsound.Beep(1200, 300)
-                else:
-                    winsound.Beep(300, 200)
-                    winsound.Beep(150, 400)
-            except: pass
-        threading.Thread(target=play_sound, daemon=True).start()
+        play_sound("victory" if victory else "defeat")
     
 # --- 5. EXECUÇÃO ---
 if __name__ == "__main__":